@@ -1,7 +1,7 @@
 import os
 from http.server import BaseHTTPRequestHandler
 # Vercel allows us to import from other folders like this
-from lib.report_generator import generate_report_text, send_telegram_message
+from lib.report_generator import generate_report_text, send_chunked_message
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -17,7 +17,7 @@ class handler(BaseHTTPRequestHandler):
         success, report_text = generate_report_text()
         
         # Send the result to the admin chat
-        send_telegram_message(MY_CHAT_ID, report_text)
+        send_chunked_message(MY_CHAT_ID, report_text)
         
         self.send_response(200)
         self.end_headers()
@@ -1,89 +1,103 @@
 import os
-import json
+import orjson
 import re
 from http.server import BaseHTTPRequestHandler
-import requests
-import pandas as pd
-from lib.report_generator import generate_report_text, get_gspread_client
-from lib.report_generator import send_telegram_message as send_chunked_message
-from lib.report_generator import generate_report_text, get_sheet_as_dataframe
+from lib.report_generator import generate_report_text, get_sheet_as_index
+from lib.report_generator import send_chunked_message, send_telegram_message, EXECUTOR
+
+INC_RE = re.compile(r'\binc\d+\b', re.IGNORECASE)
+
+
+FIELD_MAP = {
+    '• Contact Name': 'contact name', '• No. HP': 'no. hp', '• User': 'user',
+    '• Customer Type': 'customer type', '• DATEK': 'datek', '• STO': 'sto',
+    '• Status Sugar': 'status sugar', '• Proses TTR 4 Jam': 'proses ttr 4 jam', '• SN': 'sn'
+}
+
+
+_HTML_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+
+def esc(s):
+    return str(s).translate(_HTML_TABLE)
 
 
 def format_incident_details(incident_data):
-    def esc(s):
-        return str(s).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
     lines = [f"📄 Detail Ticket: <code>{esc(incident_data.get('incident', 'N/A'))}</code>"]
-    field_map = {
-        '• Contact Name': 'contact name', '• No. HP': 'no. hp', '• User': 'user',
-        '• Customer Type': 'customer type', '• DATEK': 'datek', '• STO': 'sto',
-        '• Status Sugar': 'status sugar', '• Proses TTR 4 Jam': 'proses ttr 4 jam', '• SN': 'sn'
-    }
-    for label, col_name in field_map.items():
-        if col_name in incident_data and pd.notna(incident_data[col_name]) and incident_data[col_name] != '':
-            lines.append(f"{label}: {esc(incident_data[col_name])}")
+    for label, col_name in FIELD_MAP.items():
+        val = incident_data.get(col_name, '')
+        if val != '':
+            lines.append(f"{label}: {esc(val)}")
     return "\n".join(lines)
 
+# --- Update processing, run inline before Telegram is answered ---
+def process_update(post_data):
+    try:
+        update = orjson.loads(post_data)
+
+        message = update.get("message", {})
+        chat_id = message.get("chat", {}).get("id")
+        text = message.get("text", "").strip()
+
+        if not chat_id or not text:
+            return
+
+        # --- NEW: Check for the /report command ---
+        if text == "/laporantiket":
+            # Overlap the notice with the sheet fetch; wait so ordering holds
+            notice = EXECUTOR.submit(send_telegram_message, chat_id, "Generating report, please wait...")
+            success, report_text = generate_report_text()
+            notice.result()
+            send_chunked_message(chat_id, report_text)
+            return
+
+        # --- Original logic for searching incidents ---
+        incident_ids = INC_RE.findall(text)
+        if not incident_ids:
+            # If it's not the report command and not an incident, we can ignore it
+            return
+
+        unique_ids = sorted({inc.upper() for inc in incident_ids})
+        SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID")
+        rows_by_inc = get_sheet_as_index(SPREADSHEET_ID, "SQM", columns=FIELD_MAP.values())
+
+        replies = []
+        for incident_id in unique_ids:
+            row = rows_by_inc.get(incident_id)
+            if row is None:
+                replies.append(f"❌ Tidak ditemukan: <code>{incident_id}</code>")
+            else:
+                replies.append(format_incident_details(row))
+        
+        final_reply = "\n\n".join(replies)
+        send_chunked_message(chat_id, final_reply)
+
+    except Exception as e:
+        print(f"Error: {e}")
+        admin_chat_id = os.environ.get("MY_CHAT_ID")
+        if admin_chat_id:
+            send_chunked_message(admin_chat_id, f"Bot Error in main handler: {e}")
+
 # --- VERCEL'S MAIN HANDLER ---
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
-            update = json.loads(post_data)
-
-            message = update.get("message", {})
-            chat_id = message.get("chat", {}).get("id")
-            text = message.get("text", "").strip()
-
-            if not chat_id or not text:
-                self.send_response(200)
-                self.end_headers()
-                return
-
-            # --- NEW: Check for the /report command ---
-            if text == "/laporantiket":
-                send_chunked_message(chat_id, "Generating report, please wait...")
-                success, report_text = generate_report_text()
-                send_chunked_message(chat_id, report_text)
-                # We are done, so we exit early
-                self.send_response(200)
-                self.end_headers()
-                self.wfile.write(b'{"status":"ok"}')
-                return
-
-            # --- Original logic for searching incidents ---
-            incident_ids = re.findall(r'\binc\d+\b', text, re.IGNORECASE)
-            if not incident_ids:
-                # If it's not the report command and not an incident, we can ignore it
-                self.send_response(200)
-                self.end_headers()
-                return
-
-            unique_ids = sorted(list(set(id.upper() for id in incident_ids)))
-            SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID")
-            df = get_sheet_as_dataframe(SPREADSHEET_ID, "SQM")
-            df['incident'] = df['incident'].str.upper()
-
-            replies = []
-            for incident_id in unique_ids:
-                result = df[df['incident'] == incident_id]
-                if not result.empty:
-                    incident_data = result.iloc[0].to_dict()
-                    replies.append(format_incident_details(incident_data))
-                else:
-                    replies.append(f"❌ Tidak ditemukan: <code>{incident_id}</code>")
-            
-            final_reply = "\n\n".join(replies)
-            send_chunked_message(chat_id, final_reply)
-
         except Exception as e:
-            print(f"Error: {e}")
-            admin_chat_id = os.environ.get("MY_CHAT_ID")
-            if admin_chat_id:
-                send_chunked_message(admin_chat_id, f"Bot Error in main handler: {e}")
+            print(f"Error reading request body: {e}")
+            post_data = None
+
+        # Process inline: the platform may freeze the function once the response
+        # is complete, so any work left after the 200 could be lost
+        if post_data is not None:
+            process_update(post_data)
 
         # ALWAYS reply to Telegram with a 200 OK
+        body = b'{"status":"ok"}'
         self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(b'{"status":"ok"}')
+        self.wfile.write(body)
         return
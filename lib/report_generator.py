@@ -1,52 +1,290 @@
 import os
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import gspread
-import pandas as pd
-from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 
 # --- Reusable function to get an authorized gspread client ---
+# Authorized lazily on first sheet access and reused for the life of the process
+_gc = None
+_gc_lock = threading.Lock()
+
 def get_gspread_client():
-    try:
-        creds_json_str = os.environ.get("GOOGLE_CREDENTIALS_JSON")
-        creds_info = json.loads(creds_json_str)
-        scopes = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
-        creds = Credentials.from_service_account_info(creds_info, scopes=scopes)
-        return gspread.authorize(creds)
-    except Exception as e:
-        print(f"Error loading Google credentials: {e}")
-        return None
+    global _gc
+    if _gc is not None:
+        return _gc
+    with _gc_lock:
+        if _gc is None:
+            try:
+                import gspread
+                from google.oauth2.service_account import Credentials
+                creds_json_str = os.environ.get("GOOGLE_CREDENTIALS_JSON")
+                creds_info = json.loads(creds_json_str)
+                scopes = [
+                    "https://www.googleapis.com/auth/spreadsheets.readonly",
+                    "https://www.googleapis.com/auth/drive.metadata.readonly",
+                ]
+                creds = Credentials.from_service_account_info(creds_info, scopes=scopes)
+                # Plain HTTPClient: BackOffHTTPClient keeps unlocked, never-reset
+                # backoff state on the instance, which is unsafe for a shared client
+                _gc = gspread.authorize(creds)
+            except Exception as e:
+                print(f"Error loading Google credentials: {e}")
+                return None
+    return _gc
+
+# --- Shared HTTP session so Telegram calls reuse one keep-alive connection ---
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+SESSION.headers["Content-Type"] = "application/json"
 
 # --- Reusable function to send a message ---
 def send_telegram_message(chat_id, text):
     BOT_TOKEN = os.environ.get("BOT_TOKEN")
     TELEGRAM_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
     payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
-    requests.post(f"{TELEGRAM_URL}/sendMessage", json=payload)
+    SESSION.post(f"{TELEGRAM_URL}/sendMessage", json=payload, timeout=5)
+
+# --- Long messages: split on line boundaries under Telegram's 4096-char cap ---
+TELEGRAM_MAX_LEN = 4096
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+def split_message(text, limit=TELEGRAM_MAX_LEN):
+    chunks, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+def send_chunked_message(chat_id, text):
+    # Chunks go to one chat, so they are sent in order over the shared session
+    for chunk in split_message(text):
+        send_telegram_message(chat_id, chunk)
+
+# --- In-process sheet cache, reused across warm invocations ---
+SHEET_CACHE_TTL = int(os.environ.get("SHEET_CACHE_TTL", "60"))
+_SHEET_CACHE = {}  # (kind, spreadsheet_id, sheet_name, ...) -> (fetched_at, value)
+
+# Narrow dtypes applied at ingest when fetching unformatted values
+NUMERIC_COLUMNS = ('umur tiket',)  # float64: compared to the threshold and printed
+CATEGORY_COLUMNS = ('status', 'customer type', 'sto')  # low-cardinality strings
 
-# --- Function for reading data ---
-def get_sheet_as_dataframe(spreadsheet_id, sheet_name):
+def _cached(key, loader):
+    entry = _SHEET_CACHE.get(key)
+    if entry and time.monotonic() - entry[0] < SHEET_CACHE_TTL:
+        return entry[1]
+    value = loader()
+    _SHEET_CACHE[key] = (time.monotonic(), value)
+    return value
+
+# --- Functions for reading data ---
+def _column_letter(n):
+    letters = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+# Retry delays for 429/5xx from Sheets; the total stays well under PROCESS_TIMEOUT
+SHEETS_RETRY_DELAYS = (1, 2, 4)
+
+def _fetch_sheet_values(spreadsheet_id, sheet_name, unformatted=False, columns=None):
+    """Returns the sheet as rows (header first).
+
+    With columns set, only those header names are downloaded, one range per
+    column; the header row itself is cached like any other sheet read.
+    Rate-limit and server errors are retried a bounded number of times.
+    """
+    from gspread.exceptions import APIError
+    for delay in (*SHEETS_RETRY_DELAYS, None):
+        try:
+            return _fetch_sheet_values_once(spreadsheet_id, sheet_name, unformatted, columns)
+        except APIError as e:
+            # APIError.code is -1 for non-JSON bodies (e.g. HTML 502s); use the HTTP status
+            code = e.response.status_code
+            if delay is None or not (code == 429 or code >= 500):
+                raise
+            print(f"Sheets API error {code}, retrying in {delay}s")
+            time.sleep(delay)
+
+def _fetch_sheet_values_once(spreadsheet_id, sheet_name, unformatted, columns):
+    from gspread.utils import absolute_range_name
     gc = get_gspread_client()
     if not gc:
         raise ConnectionError("Google Sheets client is not authorized.")
-    spreadsheet = gc.open_by_key(spreadsheet_id)
-    sheet = spreadsheet.worksheet(sheet_name)
-    data = sheet.get_all_records()
-    df = pd.DataFrame(data)
-    df.columns = [col.strip().lower() for col in df.columns]
+    # Values endpoints straight off the HTTP client: open_by_key would add a
+    # full spreadsheet metadata GET to every fetch
+    http = gc.http_client
+    params = {"valueRenderOption": "UNFORMATTED_VALUE"} if unformatted else {}
+    if columns is None:
+        response = http.values_get(spreadsheet_id, absolute_range_name(sheet_name), params=params)
+        rows = response.get("values", [])
+        # The API trims trailing blanks; pad so every row lines up with the header
+        width = max((len(row) for row in rows), default=0)
+        return [row + [""] * (width - len(row)) for row in rows]
+
+    # Each column is read from row 1, so the header cell that comes back with the
+    # data proves the cached header still points at the right letters
+    header_key = ('header', spreadsheet_id, sheet_name)
+    for _ in range(2):
+        header = _cached(
+            header_key,
+            lambda: http.values_get(spreadsheet_id, absolute_range_name(sheet_name, "1:1")).get("values", [[]])[0],
+        )
+        normalized = [str(col).strip().lower() for col in header]
+        wanted = [(col, normalized.index(col) + 1) for col in columns if col in normalized]
+        if not wanted:
+            return []
+        ranges = [
+            absolute_range_name(sheet_name, f"{_column_letter(i)}:{_column_letter(i)}")
+            for _, i in wanted
+        ]
+        response = http.values_batch_get(spreadsheet_id, ranges, params={**params, "majorDimension": "COLUMNS"})
+        cols = [(vr.get("values") or [[]])[0] for vr in response.get("valueRanges", [])]
+        names = [name for name, _ in wanted]
+        if [str(col[0]).strip().lower() if col else "" for col in cols] == names:
+            cols = [col[1:] for col in cols]
+            height = max((len(col) for col in cols), default=0)
+            cols = [col + [""] * (height - len(col)) for col in cols]
+            return [names] + [list(row) for row in zip(*cols)]
+        # Columns moved since the header was cached; refetch it and try once more
+        _SHEET_CACHE.pop(header_key, None)
+    raise ValueError(f"Header of sheet '{sheet_name}' changed while reading columns")
+
+def _format_age(v):
+    # Truncate (not round) to 2 decimals so a shown age never reaches the
+    # threshold it is under; 5.283333 -> "5.28", 11.999999999 -> "11.99", 7.0 -> "7"
+    whole, _, frac = f"{v:.9f}".partition('.')
+    frac = frac[:2].rstrip('0')
+    return f"{whole}.{frac}" if frac else whole
+
+def _to_float(v):
+    if isinstance(v, (int, float)):
+        return v
+    try:
+        return float(str(v).strip())
+    except ValueError:
+        return float('nan')
+
+def _values_to_dataframe(values, unformatted):
+    # pandas/numpy are imported here so the webhook's lookup path never loads them
+    import numpy as np
+    import pandas as pd
+    if not values:
+        return pd.DataFrame()
+    columns = [str(col).strip().lower() for col in values[0]]
+    df = pd.DataFrame(values[1:], columns=columns)
+    if unformatted:
+        # Most cells are native numbers already; numbers typed as text still
+        # come back as str, so parse those and map blanks/junk to NaN
+        for col in NUMERIC_COLUMNS:
+            if col in df.columns:
+                df[col] = np.array([_to_float(v) for v in df[col]], dtype=np.float64)
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                values_str = df[col].astype(str)
+                if col == 'status':
+                    values_str = values_str.str.strip().str.upper()
+                df[col] = values_str.astype('category')
     return df
 
+def get_sheet_as_dataframe(spreadsheet_id, sheet_name, unformatted=False, columns=None):
+    """Returns the sheet as a DataFrame, served from cache within SHEET_CACHE_TTL.
+
+    With unformatted=True cells come back as native values (numbers stay numbers).
+    With columns set, only those columns are fetched.
+    """
+    columns = tuple(columns) if columns else None
+    return _cached(
+        ('df', spreadsheet_id, sheet_name, unformatted, columns),
+        lambda: _values_to_dataframe(
+            _fetch_sheet_values(spreadsheet_id, sheet_name, unformatted, columns), unformatted
+        ),
+    )
+
+def _values_to_index(values):
+    if not values:
+        return {}
+    header = [str(col).strip().lower() for col in values[0]]
+    if 'incident' not in header:
+        return {}
+    inc_col = header.index('incident')
+    rows_by_inc = {}
+    for row in values[1:]:
+        inc = str(row[inc_col]).strip().upper()
+        # First row wins on duplicate ids
+        if inc not in rows_by_inc:
+            record = dict(zip(header, row))
+            record['incident'] = inc
+            rows_by_inc[inc] = record
+    return rows_by_inc
+
+def get_sheet_as_index(spreadsheet_id, sheet_name, columns=None):
+    """Returns {INCIDENT_ID: {column: value}} built from the raw sheet values, no pandas.
+
+    With columns set, only those columns are fetched ('incident' is always included).
+    """
+    if columns:
+        columns = tuple(dict.fromkeys(('incident', *columns)))
+    return _cached(
+        ('index', spreadsheet_id, sheet_name, columns),
+        lambda: _values_to_index(_fetch_sheet_values(spreadsheet_id, sheet_name, columns=columns)),
+    )
+
 # --- The Core Report Generation Logic ---
+TIMEZONE = "Asia/Tokyo"
+_TZ = ZoneInfo(TIMEZONE)
+_DT_FMT = '%d/%m/%Y %H:%M'
+EMPTY_REPORT_BODY = "Tidak ada tiket yang memenuhi kriteria."
+REPORT_COLUMNS = ('incident', 'status', 'umur tiket', 'customer type', 'sto')
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+
+# ((spreadsheet_id, threshold, modifiedTime), recorded_at) of the last empty report.
+# Ages only grow, so an unmodified sheet can't gain tickets under the threshold;
+# but data pulled in by formulas (IMPORTRANGE etc.) may not touch modifiedTime,
+# so the shortcut is trusted for at most EMPTY_REPORT_MAX_AGE seconds.
+_LAST_EMPTY_REPORT = None
+EMPTY_REPORT_MAX_AGE = int(os.environ.get("EMPTY_REPORT_MAX_AGE", str(3 * 3600)))
+_LAST_MODIFIED = {}  # spreadsheet_id -> last modifiedTime seen
+
+def _get_modified_time(gc, spreadsheet_id):
+    # Straight through the authorized session: a short timeout and no retries, so
+    # any failure (e.g. Drive API disabled) falls back to the full fetch at once
+    try:
+        response = gc.http_client.session.get(
+            f"{DRIVE_FILES_URL}/{spreadsheet_id}",
+            params={"fields": "modifiedTime", "supportsAllDrives": "true"},
+            timeout=5,
+        )
+        response.raise_for_status()
+        return response.json().get("modifiedTime")
+    except Exception as e:
+        print(f"Could not read sheet modifiedTime, doing a full fetch: {e}")
+        return None
+
 def generate_report_text():
     """
     Fetches data from Google Sheets and returns the formatted report as a string.
     Returns a tuple: (success: bool, report_text: str)
     """
+    global _LAST_EMPTY_REPORT
     SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID")
     SHEET_NAME = "SQM"
-    TIMEZONE = "Asia/Tokyo"
     THRESHOLD_UMUR = int(os.environ.get("UMUR_THRESHOLD", "12"))
 
     gc = get_gspread_client()
@@ -54,34 +292,61 @@ def generate_report_text():
         return (False, "Bot Error: Could not authorize with Google Sheets.")
 
     try:
-        df = get_sheet_as_dataframe(SPREADSHEET_ID, SHEET_NAME)
+        header = f"⏰ Laporan Tiket — {datetime.now(_TZ).strftime(_DT_FMT)}\n"
+
+        # Skip the full values fetch when nothing changed since an empty report
+        modified = _get_modified_time(gc, SPREADSHEET_ID)
+        report_key = (SPREADSHEET_ID, THRESHOLD_UMUR, modified)
+        if (
+            modified is not None
+            and _LAST_EMPTY_REPORT is not None
+            and _LAST_EMPTY_REPORT[0] == report_key
+            and time.monotonic() - _LAST_EMPTY_REPORT[1] < EMPTY_REPORT_MAX_AGE
+        ):
+            return (True, header + "\n" + EMPTY_REPORT_BODY)
+        if modified is not None and _LAST_MODIFIED.get(SPREADSHEET_ID) != modified:
+            # The sheet changed, so a cached frame may predate the edit
+            _SHEET_CACHE.pop(('df', SPREADSHEET_ID, SHEET_NAME, True, REPORT_COLUMNS), None)
+            _SHEET_CACHE.pop(('header', SPREADSHEET_ID, SHEET_NAME), None)
+            _LAST_MODIFIED[SPREADSHEET_ID] = modified
+
+        import numpy as np
+        df = get_sheet_as_dataframe(SPREADSHEET_ID, SHEET_NAME, unformatted=True, columns=REPORT_COLUMNS)
 
         # --- Filtering and Sorting Logic (same as before) ---
-        required_cols = ['status', 'umur tiket', 'incident']
-        for col in required_cols:
-            if col not in df.columns:
-                return (False, f"Error: Column '{col}' not found in spreadsheet.")
+        required_cols = ('status', 'umur tiket', 'incident')
+        cols_set = frozenset(df.columns)
+        missing = [col for col in required_cols if col not in cols_set]
+        if missing:
+            return (False, f"Error: Column(s) {', '.join(repr(c) for c in missing)} not found in spreadsheet.")
 
-        df_open = df[df['status'].str.strip().str.upper() == 'OPEN'].copy()
-        df_open['umur_numeric'] = pd.to_numeric(df_open['umur tiket'], errors='coerce')
-        df_filtered = df_open[df_open['umur_numeric'] < THRESHOLD_UMUR]
-        df_sorted = df_filtered.sort_values(by='umur_numeric', ascending=True)
+        # Single fused mask over ndarrays instead of filter/copy/filter/sort
+        # 'status' is a normalized categorical, so OPEN is a single int code compare
+        status = df['status']
+        if 'OPEN' in status.cat.categories:
+            is_open = status.cat.codes.to_numpy() == status.cat.categories.get_loc('OPEN')
+        else:
+            is_open = np.zeros(len(df), dtype=bool)
+        umur = df['umur tiket'].to_numpy()
+        mask = is_open & np.isfinite(umur) & (umur < THRESHOLD_UMUR)
+        order = np.flatnonzero(mask)[np.argsort(umur[mask], kind='stable')]
 
         # --- Formatting the Message ---
-        tz = pytz.timezone(TIMEZONE)
-        dt_str = datetime.now(tz).strftime('%d/%m/%Y %H:%M')
-        header = f"⏰ Laporan Tiket — {dt_str}\n"
-
-        if df_sorted.empty:
-            body = "Tidak ada tiket yang memenuhi kriteria."
+        _LAST_EMPTY_REPORT = (report_key, time.monotonic()) if order.size == 0 else None
+        if order.size == 0:
+            body = EMPTY_REPORT_BODY
         else:
-            rows = []
-            for _, row in df_sorted.iterrows():
-                incident = row.get('incident', '')
-                umur = row.get('umur tiket', '')
-                cust_type = row.get('customer type', '')
-                sto = row.get('sto', '')
-                rows.append(f"<code>{incident}</code> | {umur} Jam | {cust_type} | {sto}")
+            # Gather only the selected rows of the needed columns; no frame copy
+            blank = np.full(order.size, '', dtype=object)
+            incidents, cust_types, stos = (
+                df[col].take(order).to_numpy(dtype=object) if col in cols_set else blank
+                for col in ('incident', 'customer type', 'sto')
+            )
+            # str.join materializes its input anyway, so hand it a list directly
+            rows = [
+                f"<code>{incident}</code> | {_format_age(umur_val)} Jam | {cust_type} | {sto}"
+                for incident, umur_val, cust_type, sto in zip(incidents, umur[order], cust_types, stos)
+            ]
             body = "\n".join(rows)
         
         return (True, header + "\n" + body)